@@ -1,6 +1,9 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-from io import StringIO
+import pyarrow as pa
+from pyarrow import csv as pacsv
+from io import BytesIO
 from datetime import datetime
 #V1.1
 # -----------------------------------------------------------------------------
@@ -12,8 +15,7 @@ st.set_page_config(
 )
 
 # Small CSS touch to get closer to your Figma vibe
-st.markdown(
-    """
+CSS_BLOCK = """
     <style>
     .top-bar {
         background-color: #ffffff;
@@ -57,9 +59,7 @@ st.markdown(
         margin-bottom: 0.75rem;
     }
     </style>
-    """,
-    unsafe_allow_html=True,
-)
+    """
 
 # -----------------------------------------------------------------------------
 # Mock variable catalogue (similar to your treeData in React)
@@ -151,11 +151,72 @@ VARIABLES_CATALOGUE = [
     ),
 ]
 
-CATALOGUE_DF = pd.DataFrame(VARIABLES_CATALOGUE)
+
+# -----------------------------------------------------------------------------
+# Cached catalogue (built once, shared across reruns and sessions)
+# -----------------------------------------------------------------------------
+# cache_resource hands back the same objects on every rerun (no pickle/copy),
+# so callers must treat them as read-only
+@st.cache_resource
+def get_catalogue():
+    df = pd.DataFrame(VARIABLES_CATALOGUE)
+    # derived columns used on the hot paths
+    df["name_lc"] = df["name"].str.strip().str.lower()  # same as imported names
+    df["has_epic"] = df["epic_id"] != ""
+    df["has_pdms"] = df["pdms_id"] != ""
+    # export "Source" / "ID" strings depend only on the row, so build them once
+    conditions = [df["has_epic"] & df["has_pdms"], df["has_epic"], df["has_pdms"]]
+    df["source"] = np.select(conditions, ["Both", "EPIC", "PDMS"], default="-")
+    df["id_code"] = np.select(
+        conditions,
+        [df["epic_id"] + " / " + df["pdms_id"], df["epic_id"], df["pdms_id"]],
+        default="-",
+    )
+    # small closed vocabularies: compare int codes instead of strings
+    df["organ_system"] = df["organ_system"].astype("category")
+    df["group"] = df["group"].astype("category")
+    # store rows in tree order (organ system, group) so every view of the
+    # catalogue is already sorted; row position == index == selection slot
+    return df.sort_values(["organ_system", "group"], kind="stable").reset_index(
+        drop=True
+    )
+
+
+@st.cache_resource
+def get_name_index():
+    # lowercase variable name -> id, used to preselect imported configs
+    df = get_catalogue()
+    return dict(zip(df["name_lc"], df["id"]))
+
+
+@st.cache_resource
+def get_id_index():
+    # id -> catalogue row position, i.e. its slot in the selection mask
+    df = get_catalogue()
+    return dict(zip(df["id"], range(len(df))))
+
+
+CATALOGUE_DF = get_catalogue()
+NAME_LC_TO_ID = get_name_index()
+ID_INDEX = get_id_index()
+# column arrays (SoA) for the hot filter paths
+HAS_EPIC = CATALOGUE_DF["has_epic"].to_numpy()
+HAS_PDMS = CATALOGUE_DF["has_pdms"].to_numpy()
 
 # -----------------------------------------------------------------------------
 # Session-state helpers
 # -----------------------------------------------------------------------------
+EXPORT_COLUMNS = [
+    "Variable",
+    "Source",
+    "ID",
+    "Unit",
+    "Organ_System",
+    "Group",
+    "Status",
+]
+
+
 def init_state():
     if "step" not in st.session_state:
         st.session_state.step = 1
@@ -165,50 +226,156 @@ def init_state():
         st.session_state.imported_config = None  # DataFrame
     if "selected_sources" not in st.session_state:
         st.session_state.selected_sources = {"EPIC": False, "PDMS": False}
-    if "selected_variable_ids" not in st.session_state:
-        st.session_state.selected_variable_ids = set()
-    if "export_table" not in st.session_state:
-        st.session_state.export_table = pd.DataFrame(
-            columns=[
-                "Variable",
-                "Source",
-                "ID",
-                "Unit",
-                "Organ System",
-                "Group",
-                "Status",
-            ]
-        )
+    if "selected_mask" not in st.session_state:
+        # one bool per catalogue row, see mask_from_ids()
+        st.session_state.selected_mask = np.zeros(len(CATALOGUE_DF), dtype=bool)
+    if "export_rows" not in st.session_state:
+        st.session_state.export_rows = []  # list of dicts keyed by EXPORT_COLUMNS
+    if "export_version" not in st.session_state:
+        # bumped on every change to export_rows, see export_csv_bytes()
+        st.session_state.export_version = 0
 
 init_state()
 
 
 def go_next():
     st.session_state.step = min(st.session_state.step + 1, 4)
+    st.session_state.pop("editor_base_mask", None)
 
 
 def go_back():
     st.session_state.step = max(st.session_state.step - 1, 1)
+    st.session_state.pop("editor_base_mask", None)
 
 
 # -----------------------------------------------------------------------------
-# Helper: Filter catalogue by selected sources (EPIC / PDMS)
+# Helper: Variable selection as a bool mask aligned to catalogue rows
 # -----------------------------------------------------------------------------
-def filter_catalogue_by_sources():
-    df = CATALOGUE_DF.copy()
-    epic = st.session_state.selected_sources["EPIC"]
-    pdms = st.session_state.selected_sources["PDMS"]
+def mask_from_ids(ids):
+    mask = np.zeros(len(CATALOGUE_DF), dtype=bool)
+    mask[[ID_INDEX[vid] for vid in ids]] = True
+    return mask
+
+
+def apply_editor_changes(positions):
+    # on_click of the Step-3 "Apply selection" button: edited_rows holds every
+    # change since the editor was created, relative to editor_base_mask, so
+    # only those rows are touched instead of rescanning the whole grid.
+    # go_back() drops the snapshot mid-run, so a click on the Step-3 page
+    # still on screen after "◀ Back" has nothing to apply to.
+    base = st.session_state.get("editor_base_mask")
+    if base is None:
+        return
+    edits = st.session_state.catalogue_editor["edited_rows"]
+    mask = base.copy()
+    rows = [int(row) for row in edits]
+    mask[positions[rows]] = [change["Select"] for change in edits.values()]
+    st.session_state.selected_mask = mask
+
+
+def finish_mapping(positions):
+    # on_click of the Step-3 "Next ▶" submit button: pending ticks are applied
+    # first, then the export table is built from the resulting selection
+    apply_editor_changes(positions)
+    selected_mask = st.session_state.selected_mask
+    if not selected_mask.any():
+        return
+    # Build export table (initial) from the precomputed catalogue columns
+    sel = CATALOGUE_DF[selected_mask]
+    export_df = pd.DataFrame(
+        dict(
+            Variable=sel["name"],
+            Source=sel["source"],
+            ID=sel["id_code"],
+            Unit=sel["unit"],
+            Organ_System=sel["organ_system"].astype(str),
+            Group=sel["group"].astype(str),
+            Status="Published",
+        ),
+        columns=EXPORT_COLUMNS,
+    )
 
+    st.session_state.export_rows = export_df.to_dict("records")
+    st.session_state.export_version += 1
+    go_next()
+
+
+# -----------------------------------------------------------------------------
+# Helper: Step-3 preview of the selected variables (once per selection)
+# -----------------------------------------------------------------------------
+@st.cache_data(show_spinner=False, max_entries=64)
+def selected_view(mask):
+    return CATALOGUE_DF.loc[
+        mask,
+        ["name", "epic_id", "pdms_id", "organ_system", "group", "unit"],
+    ].rename(
+        columns={
+            "name": "Variable",
+            "epic_id": "EPIC ID",
+            "pdms_id": "PDMS ID",
+            "organ_system": "Organ system",
+            "group": "Group",
+            "unit": "Unit",
+        }
+    )
+
+
+# -----------------------------------------------------------------------------
+# Helper: Boolean row mask for the selected sources (EPIC / PDMS)
+# -----------------------------------------------------------------------------
+def source_mask(epic, pdms):
     if epic and pdms:
         # keep rows that have at least one ID
-        return df[(df["epic_id"] != "") | (df["pdms_id"] != "")]
+        return HAS_EPIC | HAS_PDMS
     elif epic and not pdms:
-        return df[df["epic_id"] != ""]
+        return HAS_EPIC
     elif pdms and not epic:
-        return df[df["pdms_id"] != ""]
+        return HAS_PDMS
     else:
         # nothing selected -> show everything
-        return df
+        return np.ones(len(CATALOGUE_DF), dtype=bool)
+
+
+@st.cache_resource
+def get_panel(epic, pdms):
+    # visible catalogue rows (already in tree order) for Step 3
+    return CATALOGUE_DF.loc[
+        source_mask(epic, pdms),
+        ["id", "organ_system", "group", "name", "unit", "epic_id", "pdms_id"],
+    ]
+
+
+# -----------------------------------------------------------------------------
+# Helper: Parse an uploaded configuration CSV (once per file contents)
+# -----------------------------------------------------------------------------
+# shared by every session, so uploads are kept only briefly and in small number
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=16)
+def parse_config_csv(data):
+    # Arrow's reader parses blocks of the file in parallel
+    try:
+        table = pacsv.read_csv(BytesIO(data))
+    except pa.ArrowInvalid:
+        # Arrow is strict about ragged rows; pandas' C engine pads them instead
+        return pd.read_csv(BytesIO(data), engine="c", low_memory=False)
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+# -----------------------------------------------------------------------------
+# Helper: Serialize export rows to CSV bytes
+# -----------------------------------------------------------------------------
+def to_csv_bytes(rows):
+    df = pd.DataFrame(rows, columns=EXPORT_COLUMNS)
+    return df.to_csv(index=False).encode("utf-8")
+
+
+def export_csv_bytes():
+    # per-session (version, bytes): rebuilt only after export_rows changed
+    version = st.session_state.export_version
+    cached = st.session_state.get("export_csv")
+    if cached is None or cached[0] != version:
+        cached = (version, to_csv_bytes(st.session_state.export_rows))
+        st.session_state.export_csv = cached
+    return cached[1]
 
 
 # -----------------------------------------------------------------------------
@@ -221,25 +388,27 @@ screen_titles = {
     4: "Review & Export",
 }
 
-st.markdown(
-    f"""
+TOP_BAR_TEMPLATE = """
     <div class="top-bar">
         <span class="top-bar-title">Variable Mapping Tool</span>
-        <span class="top-bar-sub">• {screen_titles[st.session_state.step]}</span>
+        <span class="top-bar-sub">• {title}</span>
     </div>
-    """,
+    """
+
+# Streamlit drops any element a rerun doesn't re-emit, so the CSS has to be
+# sent every run; it rides along with the top bar in a single element
+st.markdown(
+    CSS_BLOCK + TOP_BAR_TEMPLATE.format(title=screen_titles[st.session_state.step]),
     unsafe_allow_html=True,
 )
 
-# Back button in the navbar right side
-nav_cols = st.columns([8, 2, 2])
-with nav_cols[1]:
-    if st.session_state.step > 1:
+# Back button in the navbar right side; real "Next" buttons are inside each
+# step, so the layout is only emitted when there is a Back button to show
+if st.session_state.step > 1:
+    _, back_col, _ = st.columns([8, 2, 2])
+    with back_col:
         if st.button("◀ Back", use_container_width=True, key="back_button"):
             go_back()
-with nav_cols[2]:
-    # real "Next" buttons are inside each step, so nothing here
-    pass
 
 st.write("")  # small spacer
 
@@ -271,7 +440,7 @@ if st.session_state.step == 1:
 
         if uploaded_file is not None:
             try:
-                config_df = pd.read_csv(uploaded_file)
+                config_df = parse_config_csv(uploaded_file.getvalue())
                 st.session_state.imported_config = config_df
                 st.success(f"Loaded {len(config_df)} rows from `{uploaded_file.name}`.")
                 st.dataframe(config_df.head(), use_container_width=True)
@@ -291,14 +460,16 @@ if st.session_state.step == 1:
     if st.button("Next ▶", key="next_step1", disabled=not can_next):
         # If config loaded, pre-select variables by name
         if st.session_state.imported_config is not None:
-            imported_names = {
-                str(v).strip().lower()
-                for v in st.session_state.imported_config["Variable"].tolist()
-            }
-            preselected_ids = CATALOGUE_DF[
-                CATALOGUE_DF["name"].str.lower().isin(imported_names)
-            ]["id"].tolist()
-            st.session_state.selected_variable_ids = set(preselected_ids)
+            imported_names = set(
+                st.session_state.imported_config["Variable"]
+                .astype(str)
+                .str.strip()
+                .str.lower()
+            )
+            preselected_ids = [
+                NAME_LC_TO_ID[n] for n in imported_names & NAME_LC_TO_ID.keys()
+            ]
+            st.session_state.selected_mask = mask_from_ids(preselected_ids)
 
         go_next()
 
@@ -346,11 +517,12 @@ elif st.session_state.step == 3:
         unsafe_allow_html=True,
     )
 
-    df = filter_catalogue_by_sources()
+    epic = st.session_state.selected_sources["EPIC"]
+    pdms = st.session_state.selected_sources["PDMS"]
 
     left_col, right_col = st.columns([2.2, 3])
 
-    # LEFT: "Tree" of organ system -> group -> variables with checkboxes
+    # LEFT: the whole catalogue as one editable grid with a "Select" column
     with left_col:
         st.markdown('<div class="mapping-panel">', unsafe_allow_html=True)
         st.markdown(
@@ -358,110 +530,81 @@ elif st.session_state.step == 3:
             unsafe_allow_html=True,
         )
         st.markdown(
-            '<div class="side-panel-subtitle">Browse by organ system & group. Tick variables to add them to your mapping.</div>',
+            '<div class="side-panel-subtitle">Browse by organ system & group. Tick variables and apply the selection to add them to your mapping.</div>',
             unsafe_allow_html=True,
         )
 
-        organ_systems = sorted(df["organ_system"].unique())
-
-        for os in organ_systems:
-            with st.expander(os, expanded=True):
-                os_df = df[df["organ_system"] == os]
-                groups = sorted(os_df["group"].unique())
-                for grp in groups:
-                    st.markdown(f"**{grp}**")
-                    grp_df = os_df[os_df["group"] == grp]
-
-                    for _, row in grp_df.iterrows():
-                        src_parts = []
-                        if row["epic_id"]:
-                            src_parts.append("EPIC")
-                        if row["pdms_id"]:
-                            src_parts.append("PDMS")
-                        src_label = "/".join(src_parts) if src_parts else "–"
-
-                        key = f"var_{row['id']}"
-                        default_checked = row["id"] in st.session_state.selected_variable_ids
-                        st.checkbox(
-                            f"{row['name']}  ·  {row['unit']}  [{src_label}]",
-                            value=default_checked,
-                            key=key,
-                        )
-                    st.write("")  # small space between groups
+        panel_df = get_panel(epic, pdms)
+
+        # The editor's input must not change while the user is on this step
+        # (Streamlit would treat it as a new widget and drop pending edits), so
+        # it starts from the selection as it was on entering the step, minus
+        # anything the source filter hides.
+        if "editor_base_mask" not in st.session_state:
+            st.session_state.selected_mask = (
+                st.session_state.selected_mask & source_mask(epic, pdms)
+            )
+            st.session_state.editor_base_mask = st.session_state.selected_mask
+        base_selected = st.session_state.editor_base_mask
+
+        # A form batches ticks: the rerun happens once per "Apply selection"
+        with st.form("map_form"):
+            st.data_editor(
+                panel_df.assign(Select=base_selected[panel_df.index]),
+                column_order=[
+                    "Select", "organ_system", "group", "name", "unit", "epic_id", "pdms_id"
+                ],
+                column_config={
+                    "Select": st.column_config.CheckboxColumn("Select"),
+                    "organ_system": "Organ system",
+                    "group": "Group",
+                    "name": "Variable",
+                    "unit": "Unit",
+                    "epic_id": "EPIC ID",
+                    "pdms_id": "PDMS ID",
+                },
+                disabled=["organ_system", "group", "name", "unit", "epic_id", "pdms_id"],
+                hide_index=True,
+                use_container_width=True,
+                key="catalogue_editor",
+            )
+            positions = panel_df.index.to_numpy()
+            st.form_submit_button(
+                "Apply selection",
+                on_click=apply_editor_changes,
+                args=(positions,),
+            )
+            # Next submits the form too, so ticks that were not applied yet
+            # are never lost
+            next_clicked = st.form_submit_button(
+                "Next ▶",
+                on_click=finish_mapping,
+                args=(positions,),
+            )
 
         st.markdown('</div>', unsafe_allow_html=True)
 
-    # After rendering all checkboxes, recompute selected IDs from their states
-    selected_ids = {
-        row["id"]
-        for _, row in df.iterrows()
-        if st.session_state.get(f"var_{row['id']}", False)
-    }
-    st.session_state.selected_variable_ids = selected_ids
+    selected_mask = st.session_state.selected_mask
 
     # RIGHT: Selected variables preview
     with right_col:
         st.markdown('<div class="mapping-panel">', unsafe_allow_html=True)
         st.markdown("#### Selected variables", unsafe_allow_html=True)
 
-        if selected_ids:
-            selected_df = CATALOGUE_DF[CATALOGUE_DF["id"].isin(selected_ids)].copy()
-            selected_df_display = selected_df[
-                ["name", "epic_id", "pdms_id", "organ_system", "group", "unit"]
-            ].rename(
-                columns={
-                    "name": "Variable",
-                    "epic_id": "EPIC ID",
-                    "pdms_id": "PDMS ID",
-                    "organ_system": "Organ system",
-                    "group": "Group",
-                    "unit": "Unit",
-                }
+        if selected_mask.any():
+            st.dataframe(
+                selected_view(selected_mask), use_container_width=True, height=420
             )
-            st.dataframe(selected_df_display, use_container_width=True, height=420)
-            st.caption(f"{len(selected_ids)} variable(s) selected.")
+            st.caption(f"{selected_mask.sum()} variable(s) selected.")
         else:
-            st.info("Tick variables on the left to include them in your mapping.")
+            st.info(
+                "Tick variables on the left and apply the selection to include them in your mapping."
+            )
 
         st.markdown('</div>', unsafe_allow_html=True)
 
-    st.write("---")
-    can_next = len(selected_ids) > 0
-    if st.button("Next ▶", key="next_step3", disabled=not can_next):
-        # Build export table (initial) from catalogue
-        rows = []
-        for vid in selected_ids:
-            row = CATALOGUE_DF[CATALOGUE_DF["id"] == vid].iloc[0]
-            has_epic = bool(row["epic_id"])
-            has_pdms = bool(row["pdms_id"])
-
-            if has_epic and has_pdms:
-                source = "Both"
-                id_code = f"{row['epic_id']} / {row['pdms_id']}"
-            elif has_epic:
-                source = "EPIC"
-                id_code = row["epic_id"]
-            elif has_pdms:
-                source = "PDMS"
-                id_code = row["pdms_id"]
-            else:
-                source = "-"
-                id_code = "-"
-
-            rows.append(
-                dict(
-                    Variable=row["name"],
-                    Source=source,
-                    ID=id_code,
-                    Unit=row["unit"],
-                    Organ_System=row["organ_system"],
-                    Group=row["group"],
-                    Status="Published",
-                )
-            )
-
-        st.session_state.export_table = pd.DataFrame(rows)
-        go_next()
+    if next_clicked and not selected_mask.any():
+        st.warning("Select at least one variable to continue.")
 
 # -----------------------------------------------------------------------------
 # STEP 4 – Review & Export
@@ -472,14 +615,17 @@ elif st.session_state.step == 4:
         unsafe_allow_html=True,
     )
 
-    df = st.session_state.export_table
-
+    # rows live in a plain list; a DataFrame is only built when there is
+    # something to display
     # ---- table display ----
     st.write("### Current variable mapping")
-    if df.empty:
+    if not st.session_state.export_rows:
         st.warning("No variables to show – go back and select some.")
     else:
-        st.dataframe(df, use_container_width=True)
+        st.dataframe(
+            pd.DataFrame(st.session_state.export_rows, columns=EXPORT_COLUMNS),
+            use_container_width=True,
+        )
 
     st.write("")
 
@@ -530,35 +676,34 @@ elif st.session_state.step == 4:
                     Group=group or "General",
                     Status="New",
                 )
-                st.session_state.export_table = pd.concat(
-                    [st.session_state.export_table, pd.DataFrame([new_row])],
-                    ignore_index=True,
-                )
+                st.session_state.export_rows.append(new_row)
+                st.session_state.export_version += 1
                 st.success(f"Added variable '{var_name}'.")
-                df = st.session_state.export_table  # refresh reference
 
     st.write("")
 
     # ---- delete variables ----
-    if not df.empty:
+    if st.session_state.export_rows:
         st.write("### Delete variables")
         to_delete = st.multiselect(
             "Select variables to delete",
-            options=df["Variable"].tolist(),
+            options=[r["Variable"] for r in st.session_state.export_rows],
         )
         if st.button("Delete selected", disabled=not to_delete):
-            st.session_state.export_table = df[
-                ~df["Variable"].isin(to_delete)
-            ].reset_index(drop=True)
+            delete_set = set(to_delete)
+            st.session_state.export_rows = [
+                r
+                for r in st.session_state.export_rows
+                if r["Variable"] not in delete_set
+            ]
+            st.session_state.export_version += 1
             st.success(f"Deleted {len(to_delete)} variable(s).")
 
     st.write("---")
 
     # ---- export CSV ----
-    if not df.empty:
-        csv_buffer = StringIO()
-        df.to_csv(csv_buffer, index=False)
-        csv_data = csv_buffer.getvalue()
+    if st.session_state.export_rows:
+        csv_data = export_csv_bytes()
 
         filename = f"variable-mapping-{datetime.now().date()}.csv"
         st.download_button(